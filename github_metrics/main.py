@@ -1,25 +1,57 @@
+from __future__ import annotations
+
 import argparse
+import csv
 import dataclasses
 import datetime
-import json
 import logging
 import os
 import re
 import sys
-from hashlib import sha256
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from hashlib import blake2b
 from pathlib import Path
-from typing import Iterator, Optional
+from typing import IO, TYPE_CHECKING, Iterable, Iterator, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlsplit, urlunsplit
 
-import pandas as pd
+import orjson
 import requests
 from dateutil.parser import parse as parse_datetime
+from requests.adapters import HTTPAdapter, Retry
 
 from github_metrics import __title__
 
+if TYPE_CHECKING:
+    import pandas as pd
+
 logger = logging.getLogger(__name__)
 
+_SESSION = requests.Session()
+_SESSION.headers.update(
+    {
+        'Accept': 'application/vnd.github+json',
+        'Accept-Encoding': 'gzip',
+        'User-Agent': __title__,
+    }
+)
+_SESSION.mount(
+    'https://',
+    HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=16,
+        max_retries=Retry(
+            total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]
+        ),
+    ),
+)
+
+_MAX_WORKERS = 8
+
+_UNSAFE_RE = re.compile(r'[^A-Za-z0-9_\-.]')
 
-@dataclasses.dataclass
+
+@dataclasses.dataclass(slots=True)
 class PullRequest:
     title: str
     url: str
@@ -29,69 +61,130 @@ class PullRequest:
 
 
 def safe_filename(s: str, max_length: int = 64) -> str:
-    short_hash = sha256(s.encode()).hexdigest()[:7]
-    safe_str = re.sub(r'[^A-Za-z0-9_\-\.]', '_', s).strip('_')[:max_length]
+    short_hash = blake2b(s.encode(), digest_size=4).hexdigest()
+    safe_str = _UNSAFE_RE.sub('_', s).strip('_')[:max_length]
     return f'{safe_str}--{short_hash}'
 
 
-def github_api_list(url: str, token: str, cache_path: Path) -> Iterator[dict]:
+def _parse_link_header(link_header: str) -> dict:
+    links = {}
+    for part in link_header.split(','):
+        url, _, rel = part.partition(';')
+        rel = rel.strip()
+        if rel.startswith('rel="') and rel.endswith('"'):
+            links[rel[5:-1]] = url.strip().lstrip('<').rstrip('>')
+    return links
+
+
+@lru_cache(maxsize=None)
+def _get_page(
+    url: str, token: str, cache_path: Path
+) -> Tuple[list, Optional[str], Optional[str]]:
     # Read cache
     path = cache_path / (safe_filename(url) + '.json')
     if path.is_file():
         logger.info('Reading %s from cache', url)
-        with path.open('r') as f:
-            data = json.load(f)
-            items = data['items']
-            next_url = data['next_url']
-    else:
-        # Fetch
-        logger.info('Fetching %s', url)
-        r = requests.get(
-            url,
-            headers={
-                'Accept': 'application/vnd.github+json',
-                'Authorization': f'Bearer {token}',
-            },
-        )
-        r.raise_for_status()
+        data = orjson.loads(path.read_bytes())
+        return data['items'], data['next_url'], None
+
+    # Fetch
+    logger.info('Fetching %s', url)
+    r = _SESSION.get(url, headers={'Authorization': f'Bearer {token}'})
+    r.raise_for_status()
+
+    # Parse response
+    items = r.json()
+    links = _parse_link_header(r.headers.get('Link', ''))
+    next_url = links.get('next')
+    last_url = links.get('last')
+
+    # Write cache
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(orjson.dumps({'items': items, 'next_url': next_url}))
 
-        # Parse response
-        items = r.json()
-        m = re.search(r'<(?P<url>[^<]+)>; rel="next"', r.headers['Link'])
-        next_url = m.group('url') if m else None
+    return items, next_url, last_url
 
-        # Write cache
-        path.parent.mkdir(parents=True, exist_ok=True)
-        with path.open('w') as f:
-            data = {'items': items, 'next_url': next_url}
-            json.dump(data, f)
 
-    # Yield items
-    yield from items
+def _page_url(url: str, page: int) -> str:
+    scheme, netloc, path, query, fragment = urlsplit(url)
+    params = parse_qs(query)
+    params['page'] = [str(page)]
+    return urlunsplit(
+        (scheme, netloc, path, urlencode(params, doseq=True), fragment)
+    )
+
 
-    # Continue with next page
-    if next_url:
-        yield from github_api_list(next_url, token, cache_path)
+def _prefetch_pages(
+    last_url: str, token: str, cache_path: Path
+) -> None:
+    try:
+        last_page = int(parse_qs(urlsplit(last_url).query)['page'][0])
+    except (KeyError, ValueError):
+        return
+    urls = [_page_url(last_url, page) for page in range(2, last_page + 1)]
+    with ThreadPoolExecutor(max_workers=_MAX_WORKERS) as executor:
+        for _ in executor.map(
+            lambda page_url: _get_page(page_url, token, cache_path), urls
+        ):
+            pass
+
+
+def github_api_list(url: str, token: str, cache_path: Path) -> Iterator[dict]:
+    next_url: Optional[str] = url
+    prefetched = False
+    while next_url:
+        items, next_url, last_url = _get_page(next_url, token, cache_path)
+
+        # Warm the page cache for the remaining pages concurrently; the
+        # page count is only known when the page came from a live fetch,
+        # and one prefetch covers all remaining pages.
+        if not prefetched and next_url and last_url:
+            _prefetch_pages(last_url, token, cache_path)
+            prefetched = True
+
+        yield from items
 
 
 def fetch_pull_requests(
     owner: str, repo: str, token: str, cache_path: Path
-) -> Iterator[PullRequest]:
+) -> Iterator[dict]:
     for item in github_api_list(
         f'https://api.github.com/repos/{owner}/{repo}/pulls?state=closed',
         token,
         cache_path,
     ):
-        pull_request = transform_pull_request_item(item)
-        if pull_request:
-            yield pull_request
+        # Skip unmerged pull requests before any parsing happens.
+        if item['merged_at']:
+            yield item
+
+
+_UTC = datetime.timezone.utc
+
+
+def _parse_gh_ts(s: str) -> datetime.datetime:
+    # GitHub returns fixed-width 'YYYY-MM-DDTHH:MM:SSZ' timestamps, so
+    # slice the fields directly; fall back to dateutil in case the API
+    # format ever drifts.
+    try:
+        return datetime.datetime(
+            int(s[0:4]),
+            int(s[5:7]),
+            int(s[8:10]),
+            int(s[11:13]),
+            int(s[14:16]),
+            int(s[17:19]),
+            0,
+            _UTC,
+        )
+    except ValueError:
+        return parse_datetime(s)
 
 
 def transform_pull_request_item(item: dict) -> Optional[PullRequest]:
     if not item['merged_at']:
         return None
-    created_at = parse_datetime(item['created_at'])
-    merged_at = parse_datetime(item['merged_at'])
+    created_at = _parse_gh_ts(item['created_at'])
+    merged_at = _parse_gh_ts(item['merged_at'])
     create_to_merge_td = merged_at - created_at
     create_to_merge_minutes = round(create_to_merge_td.total_seconds() / 60)
     return PullRequest(
@@ -103,34 +196,102 @@ def transform_pull_request_item(item: dict) -> Optional[PullRequest]:
     )
 
 
-def calc_stats_daily(df: pd.DataFrame) -> pd.DataFrame:
+def transform_pull_request_items(
+    items: Iterable[dict],
+) -> Iterator[PullRequest]:
+    for item in items:
+        pull_request = transform_pull_request_item(item)
+        if pull_request:
+            yield pull_request
+
+
+def write_pull_requests_as_csv(
+    pull_requests: Iterable[PullRequest], f: IO[str]
+) -> None:
+    writer = csv.writer(f)
+    writer.writerow(
+        [
+            'title',
+            'url',
+            'created_at',
+            'merged_at',
+            'created_to_merged_minutes',
+        ]
+    )
+    writer.writerows(
+        (
+            pull_request.title,
+            pull_request.url,
+            pull_request.created_at.isoformat(),
+            pull_request.merged_at.isoformat(),
+            pull_request.created_to_merged_minutes,
+        )
+        for pull_request in pull_requests
+    )
+
+
+def create_dataframe(items: list) -> pd.DataFrame:
+    # Import pandas lazily; it is only needed when stats are requested.
+    import pandas as pd
+
+    df = pd.DataFrame(
+        {
+            'title': [item['title'] for item in items],
+            'url': [item['html_url'] for item in items],
+            'created_at': [item['created_at'] for item in items],
+            'merged_at': [item['merged_at'] for item in items],
+        }
+    )
+    df['created_at'] = pd.to_datetime(
+        df['created_at'], format='ISO8601', utc=True
+    )
+    df['merged_at'] = pd.to_datetime(
+        df['merged_at'], format='ISO8601', utc=True
+    )
+    # All timestamps are UTC and the stats are bucketed by date only, so
+    # drop the timezone; pandas groups tz-naive datetimes much faster.
+    df['created_at'] = df['created_at'].dt.tz_localize(None)
+    df['merged_at'] = df['merged_at'].dt.tz_localize(None)
+    df['created_to_merged_minutes'] = (
+        ((df['merged_at'] - df['created_at']).dt.total_seconds() / 60)
+        .round()
+        .astype('int32')
+    )
+    return df
+
+
+def calc_stats_daily(
+    df_created: pd.DataFrame, df_merged: pd.DataFrame
+) -> pd.DataFrame:
+    import pandas as pd
+
+    g_created = df_created.resample('D')
+    g_merged = df_merged.resample('D')
     return pd.DataFrame(
         {
-            'created_daily': df.groupby(
-                [pd.Grouper(key='created_at', freq='D')]
-            )['created_at'].count(),
-            'merged_daily': df.groupby(
-                [pd.Grouper(key='merged_at', freq='D')]
-            )['merged_at'].count(),
-            'created_to_merged_minutes_daily': df.groupby(
-                [pd.Grouper(key='merged_at', freq='D')]
-            )['created_to_merged_minutes'].mean(),
+            'created_daily': g_created['url'].count(),
+            'merged_daily': g_merged['url'].count(),
+            'created_to_merged_minutes_daily': g_merged[
+                'created_to_merged_minutes'
+            ].mean(),
         }
     )
 
 
-def calc_stats_weekly(df: pd.DataFrame) -> pd.DataFrame:
+def calc_stats_weekly(
+    df_created: pd.DataFrame, df_merged: pd.DataFrame
+) -> pd.DataFrame:
+    import pandas as pd
+
+    g_created = df_created.resample('W')
+    g_merged = df_merged.resample('W')
     return pd.DataFrame(
         {
-            'created_weekly': df.groupby(
-                [pd.Grouper(key='created_at', freq='W')]
-            )['created_at'].count(),
-            'merged_weekly': df.groupby(
-                [pd.Grouper(key='merged_at', freq='W')]
-            )['merged_at'].count(),
-            'created_to_merged_minutes_weekly': df.groupby(
-                [pd.Grouper(key='merged_at', freq='W')]
-            )['created_to_merged_minutes'].mean(),
+            'created_weekly': g_created['url'].count(),
+            'merged_weekly': g_merged['url'].count(),
+            'created_to_merged_minutes_weekly': g_merged[
+                'created_to_merged_minutes'
+            ].mean(),
         }
     )
 
@@ -173,24 +334,20 @@ def main():
     if not token:
         raise Exception('Missing ACCESS_TOKEN environment variable')
 
-    pull_requests = fetch_pull_requests(
-        args.owner, args.repo, token, args.cache
-    )
-    df = pd.DataFrame(dataclasses.asdict(pr) for pr in pull_requests)
-    df.to_csv(
-        args.data,
-        index_label='created_at',
-        columns=[
-            'title',
-            'url',
-            'created_at',
-            'merged_at',
-            'created_to_merged_minutes',
-        ],
+    items = list(
+        fetch_pull_requests(args.owner, args.repo, token, args.cache)
     )
+    write_pull_requests_as_csv(transform_pull_request_items(items), args.data)
+
+    if args.stats_daily or args.stats_weekly:
+        df = create_dataframe(items)
+        # Index and sort once; the daily and weekly stats reuse the
+        # sorted frames.
+        df_created = df.set_index('created_at').sort_index()
+        df_merged = df.set_index('merged_at').sort_index()
 
     if args.stats_daily:
-        df_stats_daily = calc_stats_daily(df)
+        df_stats_daily = calc_stats_daily(df_created, df_merged)
         df_stats_daily.to_csv(
             args.stats_daily,
             index_label='date',
@@ -203,7 +360,7 @@ def main():
         )
 
     if args.stats_weekly:
-        df_stats_weekly = calc_stats_weekly(df)
+        df_stats_weekly = calc_stats_weekly(df_created, df_merged)
         df_stats_weekly.to_csv(
             args.stats_weekly,
             index_label='date',